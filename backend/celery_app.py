@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.signals import worker_process_init
 import os
 
 # Get Redis URL from environment
@@ -24,8 +25,15 @@ celery_app.conf.update(
     task_soft_time_limit=4 * 60 * 60 - 60,  # 4 hours - 1 minute
     worker_prefetch_multiplier=1,
     worker_max_tasks_per_child=1000,
+    worker_concurrency=int(os.getenv("WORKER_CONCURRENCY", "1")),  # Also used by the CPU resource planner
 )
 
+@worker_process_init.connect
+def configure_worker_process(**kwargs):
+    """Pin each child process to its share of the cores before any task runs"""
+    from .resources import apply_plan, plan_resources
+    apply_plan(plan_resources())
+
 # Auto-discover tasks
 celery_app.autodiscover_tasks(["backend"])
 
@@ -0,0 +1,413 @@
+"""
+Stockage des datasets téléversés par morceaux (chunks).
+
+Les morceaux sont reçus en streaming, hachés (SHA-256) à la volée puis rangés
+dans un magasin adressé par contenu, ce qui garantit l'intégrité et évite de
+stocker deux fois le même morceau. L'assemblage, l'extraction des archives et
+la validation sont effectués par le worker Celery (voir `tasks.ingest_dataset`).
+"""
+import os
+import re
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import tarfile
+import zipfile
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import aiofiles
+import billiard
+import yaml
+
+logger = logging.getLogger(__name__)
+
+DATASETS_ROOT = os.getenv("DATASETS_ROOT", "/app/datasets")
+CHUNK_STORE_DIR = os.path.join(DATASETS_ROOT, ".chunks")
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024  # 8 Mio
+MAX_CHUNK_SIZE = 64 * 1024 * 1024  # 64 Mio
+COPY_BUFFER_SIZE = 1024 * 1024
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+IMAGE_SUFFIXES = (".bmp", ".jpg", ".jpeg", ".png", ".tif", ".tiff", ".webp")
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+VALIDATION_BATCH_SIZE = 256
+MAX_REPORTED_ISSUES = 50
+CHUNK_GC_GRACE_SECONDS = 60 * 60  # Ne pas supprimer un morceau en cours d'enregistrement
+
+
+# --- Chemins et manifeste ---
+
+def normalize_relative_path(path: str) -> str:
+    """Normalise un chemin relatif déclaré par le client et refuse toute sortie du dataset."""
+    normalized = os.path.normpath(path.replace("\\", "/")).lstrip("/")
+    if not normalized or normalized == "." or normalized.startswith(".."):
+        raise ValueError(f"Chemin de fichier invalide : {path}")
+    return normalized
+
+
+def is_archive(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def chunk_count(size: int, chunk_size: int) -> int:
+    """Nombre de morceaux attendus pour un fichier (un fichier vide compte un morceau vide)."""
+    return max(1, -(-size // chunk_size))
+
+
+def expected_chunk_size(size: int, chunk_size: int, index: int) -> int:
+    return min(chunk_size, size - index * chunk_size)
+
+
+def is_sha256(value: str) -> bool:
+    return bool(SHA256_PATTERN.match(value))
+
+
+def chunk_store_path(sha256: str) -> str:
+    # L'empreinte sert de nom de fichier: tout autre contenu pourrait sortir du magasin
+    assert is_sha256(sha256), f"Empreinte SHA-256 invalide : {sha256!r}"
+    return os.path.join(CHUNK_STORE_DIR, sha256[:2], sha256)
+
+
+def dataset_dir(dataset_id: str) -> str:
+    return os.path.join(DATASETS_ROOT, str(dataset_id))
+
+
+def image_to_label_path(image_path: str) -> str:
+    """Chemin du fichier d'annotations YOLO associé à une image (même convention qu'Ultralytics)."""
+    sep = os.sep
+    if f"{sep}images{sep}" in image_path:
+        head, _, tail = image_path.rpartition(f"{sep}images{sep}")
+        image_path = f"{head}{sep}labels{sep}{tail}"
+    return os.path.splitext(image_path)[0] + ".txt"
+
+
+def list_images(directory: str) -> List[str]:
+    """Liste triée des images d'un dossier, récursivement."""
+    images = []
+    for current, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.lower().endswith(IMAGE_SUFFIXES):
+                images.append(os.path.join(current, filename))
+    images.sort()
+    return images
+
+
+# --- Réception des morceaux (API) ---
+
+async def receive_chunk(
+    stream: AsyncIterator[bytes],
+    expected_size: int,
+    expected_sha256: Optional[str] = None,
+) -> Tuple[str, bool]:
+    """
+    Écrit un morceau reçu en streaming dans le magasin, sans le garder en mémoire.
+
+    Retourne `(sha256, deduplicated)`; `deduplicated` vaut True si un morceau
+    identique était déjà stocké. Lève `ValueError` si la taille ou l'empreinte
+    ne correspondent pas à ce qui est attendu.
+    """
+    tmp_dir = os.path.join(CHUNK_STORE_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            async for data in stream:
+                received += len(data)
+                if received > expected_size:
+                    raise ValueError(f"Morceau trop volumineux : plus de {expected_size} octets reçus.")
+                digest.update(data)
+                await f.write(data)
+
+        if received != expected_size:
+            raise ValueError(f"Morceau incomplet : {received} octets reçus sur {expected_size}.")
+
+        sha256 = digest.hexdigest()
+        if expected_sha256 and expected_sha256.lower() != sha256:
+            raise ValueError(f"Empreinte SHA-256 invalide : attendu {expected_sha256}, calculé {sha256}.")
+
+        destination = chunk_store_path(sha256)
+        if os.path.exists(destination):
+            os.remove(tmp_path)
+            touch_chunk(sha256)
+            return sha256, True
+
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(tmp_path, destination)
+        return sha256, False
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# --- Assemblage, extraction et validation (worker) ---
+
+def assemble_file(chunk_hashes: Iterable[str], destination: str) -> str:
+    """Reconstitue un fichier à partir de ses morceaux et retourne son empreinte SHA-256."""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    digest = hashlib.sha256()
+    with open(destination, "wb") as out:
+        for sha256 in chunk_hashes:
+            with open(chunk_store_path(sha256), "rb") as chunk:
+                while True:
+                    data = chunk.read(COPY_BUFFER_SIZE)
+                    if not data:
+                        break
+                    digest.update(data)
+                    out.write(data)
+    return digest.hexdigest()
+
+
+@contextmanager
+def process_pool(workers: int, context: str = "fork", initializer=None, initargs=()):
+    """
+    Pool de processus utilisable depuis une tâche Celery.
+
+    Les processus enfants du worker prefork sont démoniques: `multiprocessing`
+    et `concurrent.futures` y refusent de créer des processus, contrairement à billiard.
+    Soumettre le travail avec `pool_starmap`; le pool est fermé proprement en fin de bloc.
+    """
+    pool = billiard.get_context(context).Pool(processes=max(1, workers), initializer=initializer, initargs=initargs)
+    try:
+        yield pool
+    except BaseException:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    pool.join()
+
+
+def pool_starmap(pool, func, args_list: Iterable[tuple]) -> Iterator[Any]:
+    """
+    Exécute `func(*args)` dans le pool pour chaque élément et retourne les résultats dans l'ordre.
+
+    Chaque appel est soumis séparément (`apply_async`): pour `map`, `starmap` et
+    `imap*`, billiard attribue tous les résultats au premier processus ayant pris
+    une tâche, et les autres attendent 30 s la confirmation de leurs résultats
+    avant de pouvoir s'arrêter.
+    """
+    results = [pool.apply_async(func, args) for args in args_list]
+    for result in results:
+        yield result.get()
+
+
+def _is_within(directory: str, path: str) -> bool:
+    directory = os.path.realpath(directory)
+    return os.path.realpath(path).startswith(directory + os.sep)
+
+
+def _extract_zip_members(archive_path: str, names: List[str], destination: str) -> int:
+    with zipfile.ZipFile(archive_path) as archive:
+        for name in names:
+            if not _is_within(destination, os.path.join(destination, name)):
+                raise ValueError(f"Entrée d'archive hors du dataset : {name}")
+            archive.extract(name, destination)
+    return len(names)
+
+
+def extract_archive(archive_path: str, destination: str, workers: int = 1) -> None:
+    """
+    Extrait une archive dans `destination`.
+
+    Les archives ZIP sont extraites en parallèle (chaque processus ouvre sa
+    propre copie de l'archive et traite une partie des entrées); les archives
+    TAR, lisibles uniquement de façon séquentielle, sont extraites en un seul passage.
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            names = archive.namelist()
+        # Créer tous les dossiers avant de répartir les entrées: sinon deux processus
+        # extrayant des fichiers voisins se disputent la création du même dossier
+        for name in names:
+            parent = name if name.endswith("/") else os.path.dirname(name)
+            if parent:
+                if not _is_within(destination, os.path.join(destination, parent, "_")):
+                    raise ValueError(f"Entrée d'archive hors du dataset : {name}")
+                os.makedirs(os.path.join(destination, parent), exist_ok=True)
+
+        workers = max(1, min(workers, len(names)))
+        if workers == 1:
+            _extract_zip_members(archive_path, names, destination)
+            return
+        with process_pool(workers) as pool:
+            list(pool_starmap(pool, _extract_zip_members, [(archive_path, names[i::workers], destination) for i in range(workers)]))
+        return
+
+    if tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path, "r:*") as archive:
+            if hasattr(tarfile, "data_filter"):
+                archive.extractall(destination, filter="data")
+            else:
+                for member in archive.getmembers():
+                    if member.issym() or member.islnk() or not _is_within(destination, os.path.join(destination, member.name)):
+                        raise ValueError(f"Entrée d'archive non autorisée : {member.name}")
+                archive.extractall(destination)
+        return
+
+    raise ValueError(f"Format d'archive non supporté : {os.path.basename(archive_path)}")
+
+
+def find_dataset_root(directory: str) -> str:
+    """Descend dans les dossiers englobants uniques (ex: `mon_dataset/`) jusqu'à trouver `train/`."""
+    current = directory
+    while not os.path.isdir(os.path.join(current, "train")):
+        entries = [e for e in os.listdir(current) if not e.startswith(".") and e != "__MACOSX"]
+        subdirs = [e for e in entries if os.path.isdir(os.path.join(current, e))]
+        if len(subdirs) != 1 or len(entries) != 1:
+            raise ValueError("Structure de dataset invalide : dossier 'train/' introuvable.")
+        current = os.path.join(current, subdirs[0])
+    return current
+
+
+def _validate_label_file(label_path: str, nc: Optional[int]) -> Optional[str]:
+    with open(label_path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            values = line.split()
+            if not values:
+                continue
+            if len(values) < 5:
+                return f"{label_path}:{line_number} : au moins 5 valeurs attendues"
+            try:
+                cls = int(values[0])
+                coords = [float(v) for v in values[1:]]
+            except ValueError:
+                return f"{label_path}:{line_number} : valeur non numérique"
+            if cls < 0 or (nc is not None and cls >= nc):
+                return f"{label_path}:{line_number} : classe {cls} hors de [0, {nc})"
+            if any(c < 0.0 or c > 1.0 for c in coords):
+                return f"{label_path}:{line_number} : coordonnées non normalisées"
+    return None
+
+
+def _validate_batch(image_paths: List[str], nc: Optional[int]) -> Dict[str, Any]:
+    from PIL import Image
+
+    result = {"images": 0, "labels": 0, "missing_labels": 0, "corrupt_images": 0, "invalid_labels": 0, "issues": []}
+    for image_path in image_paths:
+        try:
+            with Image.open(image_path) as image:
+                image.verify()
+        except Exception as e:
+            result["corrupt_images"] += 1
+            result["issues"].append(f"{image_path} : image illisible ({e})")
+            continue
+        result["images"] += 1
+
+        label_path = image_to_label_path(image_path)
+        if not os.path.exists(label_path):
+            result["missing_labels"] += 1
+            continue
+        result["labels"] += 1
+        issue = _validate_label_file(label_path, nc)
+        if issue:
+            result["invalid_labels"] += 1
+            result["issues"].append(issue)
+    return result
+
+
+def validate_dataset(root: str, workers: int = 1) -> Dict[str, Any]:
+    """
+    Vérifie les images et annotations des splits `train` et `val` en parallèle.
+
+    Les problèmes isolés (image illisible, annotation invalide) sont rapportés
+    sans bloquer l'ingestion, Ultralytics ignorant ces fichiers; un split
+    absent ou sans aucune image valide lève `ValueError`.
+    """
+    nc = None
+    dataset_yaml_path = os.path.join(root, "dataset.yaml")
+    if os.path.exists(dataset_yaml_path):
+        with open(dataset_yaml_path, "r") as f:
+            nc = (yaml.safe_load(f) or {}).get("nc")
+
+    report = {"nc": nc, "splits": {}, "issues": []}
+    with process_pool(workers) as pool:
+        for split in ("train", "val"):
+            split_dir = os.path.join(root, split)
+            if not os.path.isdir(split_dir):
+                raise ValueError(f"Structure de dataset invalide : dossier '{split}/' introuvable.")
+
+            images = list_images(split_dir)
+            batches = [images[i:i + VALIDATION_BATCH_SIZE] for i in range(0, len(images), VALIDATION_BATCH_SIZE)]
+            totals = {"images": 0, "labels": 0, "missing_labels": 0, "corrupt_images": 0, "invalid_labels": 0}
+            for batch_result in pool_starmap(pool, _validate_batch, [(batch, nc) for batch in batches]):
+                for key in totals:
+                    totals[key] += batch_result[key]
+                remaining = MAX_REPORTED_ISSUES - len(report["issues"])
+                report["issues"].extend(batch_result["issues"][:max(0, remaining)])
+
+            if totals["images"] == 0:
+                raise ValueError(f"Le split '{split}' ne contient aucune image valide.")
+            report["splits"][split] = totals
+
+    return report
+
+
+def write_training_config(dataset_path: str, output_dir: str) -> str:
+    """Écrit le `dataset.yaml` utilisé par Ultralytics dans `output_dir` et retourne son chemin."""
+    dataset_config = {
+        'train': os.path.join(dataset_path, 'train'),
+        'val': os.path.join(dataset_path, 'val'),
+        'nc': 1,
+        'names': ['vehicle']  # par défaut
+    }
+    dataset_yaml_path = os.path.join(dataset_path, 'dataset.yaml')
+    if os.path.exists(dataset_yaml_path):
+        with open(dataset_yaml_path, 'r') as f:
+            loaded_dataset_config = yaml.safe_load(f)
+            dataset_config['nc'] = loaded_dataset_config.get('nc', dataset_config['nc'])
+            dataset_config['names'] = loaded_dataset_config.get('names', dataset_config['names'])
+
+    dataset_config_path = os.path.join(output_dir, 'dataset.yaml')
+    with open(dataset_config_path, 'w') as f:
+        yaml.dump(dataset_config, f)
+    return dataset_config_path
+
+
+def remove_dataset_dir(dataset_id: str) -> None:
+    directory = dataset_dir(dataset_id)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+
+
+# --- Nettoyage du magasin de morceaux ---
+
+def touch_chunk(sha256: str) -> None:
+    """Rafraîchit la date d'un morceau réutilisé pour qu'il échappe au ramasse-miettes."""
+    try:
+        os.utime(chunk_store_path(sha256))
+    except FileNotFoundError:
+        pass
+
+
+def garbage_collect_chunks(referenced: Iterable[str], grace_seconds: int = CHUNK_GC_GRACE_SECONDS) -> int:
+    """
+    Supprime les morceaux qu'aucune ligne `DatasetChunk` ne référence plus,
+    ainsi que les fichiers temporaires abandonnés.
+
+    Les fichiers modifiés depuis moins de `grace_seconds` sont conservés: un
+    morceau tout juste reçu n'est référencé qu'après l'enregistrement de sa ligne.
+    """
+    referenced = set(referenced)
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    if not os.path.isdir(CHUNK_STORE_DIR):
+        return removed
+    for current, _, filenames in os.walk(CHUNK_STORE_DIR):
+        in_tmp = os.path.basename(current) == "tmp"
+        for filename in filenames:
+            if not in_tmp and (not is_sha256(filename) or filename in referenced):
+                continue
+            path = os.path.join(current, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
@@ -0,0 +1,317 @@
+"""
+Évaluation des modèles YOLO à partir de prédictions mises en cache.
+
+L'inférence est exécutée une seule fois, par lots, dans plusieurs processus
+CPU. Les prédictions brutes (seuil de confiance très bas) et la vérité terrain
+sont enregistrées colonne par colonne dans un fichier `.npz` compressé. Les
+métriques à n'importe quel seuil de confiance/IoU, globales ou par classe,
+sont ensuite recalculées de façon vectorisée à partir de ce fichier.
+"""
+import os
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .datasets import image_to_label_path, pool_starmap, process_pool
+
+EVALUATIONS_ROOT = os.getenv("EVALUATIONS_ROOT", "/app/models/evaluations")
+PREDICTION_CONF = 0.001  # Conserver presque toutes les détections pour filtrer plus tard
+NMS_IOU = 0.7  # Même valeur que `model.val()` d'Ultralytics
+MAP_IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+EPS = 1e-16
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz  # `np.trapz` est renommé à partir de numpy 2.0
+
+_MODEL = None
+
+
+# --- Inférence (processus de travail) ---
+
+def _init_worker(model_path: str, threads: int) -> None:
+    global _MODEL
+    import torch
+    from ultralytics import YOLO
+
+    torch.set_num_threads(max(1, threads))
+    _MODEL = YOLO(model_path)
+
+
+def _predict_batch(args) -> Dict[str, Any]:
+    start, image_paths, image_size = args
+    import cv2
+
+    indices, images, unreadable = [], [], []
+    for offset, image_path in enumerate(image_paths):
+        image = cv2.imread(image_path)
+        if image is None:
+            unreadable.append(start + offset)
+        else:
+            indices.append(start + offset)
+            images.append(image)
+
+    pred_image, pred_class, pred_conf, pred_boxes = [], [], [], []
+    if images:
+        # Une liste de tableaux numpy est traitée par Ultralytics comme un seul lot
+        results = _MODEL.predict(images, imgsz=image_size, conf=PREDICTION_CONF, iou=NMS_IOU, device="cpu", verbose=False)
+        for image_index, result in zip(indices, results):
+            boxes = result.boxes
+            n = len(boxes)
+            pred_image.append(np.full(n, image_index, dtype=np.int32))
+            pred_class.append(boxes.cls.cpu().numpy().astype(np.int32))
+            pred_conf.append(boxes.conf.cpu().numpy().astype(np.float32))
+            pred_boxes.append(boxes.xyxyn.cpu().numpy().astype(np.float32).reshape(-1, 4))
+
+    return {
+        "pred_image": np.concatenate(pred_image) if pred_image else np.zeros(0, np.int32),
+        "pred_class": np.concatenate(pred_class) if pred_class else np.zeros(0, np.int32),
+        "pred_conf": np.concatenate(pred_conf) if pred_conf else np.zeros(0, np.float32),
+        "pred_boxes": np.concatenate(pred_boxes) if pred_boxes else np.zeros((0, 4), np.float32),
+        "unreadable": unreadable,
+        "names": dict(_MODEL.names),
+    }
+
+
+def run_inference(
+    model_path: str,
+    image_paths: List[str],
+    image_size: int = 640,
+    batch_size: int = 16,
+    workers: int = 1,
+    threads_per_worker: int = 1,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Exécute l'inférence par lots dans `workers` processus, chacun chargeant le modèle une fois.
+
+    Les processus (pool billiard, voir `datasets.process_pool`) sont démarrés
+    en mode `spawn` pour ne pas hériter de l'état de torch du worker Celery.
+    """
+    batches = [(i, image_paths[i:i + batch_size], image_size) for i in range(0, len(image_paths), batch_size)]
+    outputs = []
+    started = time.perf_counter()
+    with process_pool(workers, "spawn", _init_worker, (model_path, threads_per_worker)) as pool:
+        for output in pool_starmap(pool, _predict_batch, [(batch,) for batch in batches]):
+            outputs.append(output)
+            if progress_callback:
+                progress_callback(len(outputs), len(batches))
+    elapsed = time.perf_counter() - started
+
+    predictions = {
+        key: np.concatenate([o[key] for o in outputs]) if outputs else np.zeros((0, 4) if key == "pred_boxes" else 0)
+        for key in ("pred_image", "pred_class", "pred_conf", "pred_boxes")
+    }
+    order = np.argsort(predictions["pred_image"], kind="stable")
+    predictions = {key: value[order] for key, value in predictions.items()}
+    predictions["unreadable"] = sorted(i for o in outputs for i in o["unreadable"])
+    predictions["names"] = outputs[0]["names"] if outputs else {}
+    predictions["inference_seconds"] = elapsed
+    return predictions
+
+
+def load_ground_truth(image_paths: List[str], skip: Optional[List[int]] = None) -> Dict[str, np.ndarray]:
+    """
+    Lit les annotations YOLO (xywh normalisés, ou polygones) et les convertit en boîtes xyxy normalisées.
+
+    Les images d'index `skip` (illisibles lors de l'inférence) sont ignorées,
+    comme le fait Ultralytics: leurs annotations ne comptent pas comme des faux négatifs.
+    """
+    skip = set(skip or [])
+    gt_image, gt_class, gt_boxes = [], [], []
+    for image_index, image_path in enumerate(image_paths):
+        if image_index in skip:
+            continue
+        label_path = image_to_label_path(image_path)
+        if not os.path.exists(label_path):
+            continue
+        with open(label_path, "r") as f:
+            for line in f:
+                values = line.split()
+                if len(values) < 5:
+                    continue
+                coords = np.array(values[1:], dtype=np.float32)
+                if len(coords) == 4:
+                    x, y, w, h = coords
+                    box = (x - w / 2, y - h / 2, x + w / 2, y + h / 2)
+                else:
+                    xs, ys = coords[0::2], coords[1::2]
+                    box = (xs.min(), ys.min(), xs.max(), ys.max())
+                gt_image.append(image_index)
+                gt_class.append(int(values[0]))
+                gt_boxes.append(box)
+
+    return {
+        "gt_image": np.array(gt_image, dtype=np.int32),
+        "gt_class": np.array(gt_class, dtype=np.int32),
+        "gt_boxes": np.array(gt_boxes, dtype=np.float32).reshape(-1, 4),
+    }
+
+
+# --- Cache des prédictions ---
+
+def predictions_path(evaluation_id: str) -> str:
+    return os.path.join(EVALUATIONS_ROOT, str(evaluation_id), "predictions.npz")
+
+
+def save_predictions(path: str, image_paths: List[str], names: Dict[int, str], predictions: Dict[str, Any], ground_truth: Dict[str, np.ndarray]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    class_ids = sorted(names)
+    np.savez_compressed(
+        path,
+        images=np.array(image_paths),
+        class_ids=np.array(class_ids, dtype=np.int32),
+        class_names=np.array([names[i] for i in class_ids]),
+        pred_image=predictions["pred_image"].astype(np.int32),
+        pred_class=predictions["pred_class"].astype(np.int32),
+        pred_conf=predictions["pred_conf"].astype(np.float32),
+        pred_boxes=predictions["pred_boxes"].astype(np.float32),
+        unreadable=np.array(predictions["unreadable"], dtype=np.int32),
+        **ground_truth,
+    )
+
+
+@lru_cache(maxsize=8)
+def load_predictions(path: str) -> Dict[str, np.ndarray]:
+    """Charge un cache de prédictions (gardé en mémoire pour les requêtes suivantes)."""
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+# --- Métriques vectorisées ---
+
+def box_iou_pairs(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU entre les boîtes xyxy `a[i]` et `b[i]`, ligne à ligne."""
+    inter_w = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    inter = inter_w * inter_h
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a + area_b - inter + EPS)
+
+
+def match_predictions(data: Dict[str, np.ndarray], iou_thresholds: np.ndarray) -> np.ndarray:
+    """
+    Marque les vrais positifs pour chaque seuil d'IoU (tableau booléen [n_pred, n_seuils]).
+
+    Seules les paires prédiction/annotation de même image et même classe sont
+    comparées. Comme dans COCO, les prédictions sont parcourues par confiance
+    décroissante et chacune prend la meilleure annotation encore libre: filtrer
+    ensuite à un seuil de confiance plus élevé ne fait que retirer la fin de la
+    liste, sans changer les associations des prédictions conservées.
+    """
+    pred_image, pred_class, pred_boxes = data["pred_image"], data["pred_class"], data["pred_boxes"]
+    gt_image, gt_class, gt_boxes = data["gt_image"], data["gt_class"], data["gt_boxes"]
+    tp = np.zeros((len(pred_image), len(iou_thresholds)), dtype=bool)
+    if len(pred_image) == 0 or len(gt_image) == 0:
+        return tp
+
+    # Clé (image, classe) commune pour retrouver les annotations candidates de chaque prédiction
+    n_classes = int(max(pred_class.max(), gt_class.max())) + 1
+    gt_key = gt_image.astype(np.int64) * n_classes + gt_class
+    pred_key = pred_image.astype(np.int64) * n_classes + pred_class
+    gt_order = np.argsort(gt_key, kind="stable")
+    sorted_gt_key = gt_key[gt_order]
+    starts = np.searchsorted(sorted_gt_key, pred_key, side="left")
+    counts = np.searchsorted(sorted_gt_key, pred_key, side="right") - starts
+
+    pair_pred = np.repeat(np.arange(len(pred_key)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_gt = gt_order[np.repeat(starts, counts) + offsets]
+    iou = box_iou_pairs(pred_boxes[pair_pred], gt_boxes[pair_gt])
+
+    # Seules les paires au-dessus du plus petit seuil peuvent donner un vrai positif
+    keep = iou >= iou_thresholds.min()
+    pair_pred, pair_gt, iou = pair_pred[keep], pair_gt[keep], iou[keep]
+
+    # Ordre de traitement: confiance décroissante, puis IoU décroissante pour une même prédiction
+    order = np.lexsort((-iou, pair_pred, -data["pred_conf"][pair_pred]))
+    pair_pred, pair_gt, iou = pair_pred[order], pair_gt[order], iou[order]
+    for t, threshold in enumerate(iou_thresholds):
+        above = iou >= threshold
+        matched_pred, matched_gt = set(), set()
+        for p, g in zip(pair_pred[above].tolist(), pair_gt[above].tolist()):
+            if p not in matched_pred and g not in matched_gt:
+                matched_pred.add(p)
+                matched_gt.add(g)
+        tp[list(matched_pred), t] = True
+    return tp
+
+
+def average_precision(recall: np.ndarray, precision: np.ndarray) -> float:
+    """AP par interpolation sur 101 points (méthode COCO)."""
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return float(_trapezoid(np.interp(x, mrec, mpre), x))
+
+
+def compute_metrics(data: Dict[str, np.ndarray], conf_threshold: float = 0.25, iou_threshold: float = 0.5, per_class: bool = False) -> Dict[str, Any]:
+    """
+    Calcule précision, rappel et F1 au seuil de confiance donné, et les AP
+    (mAP50, mAP50-95 et AP au seuil d'IoU demandé) sur toutes les prédictions mises en cache.
+    """
+    iou_thresholds = np.unique(np.append(MAP_IOU_THRESHOLDS, iou_threshold))
+    i50 = int(np.argmin(np.abs(iou_thresholds - 0.5)))
+    i_req = int(np.argmin(np.abs(iou_thresholds - iou_threshold)))
+    i_map = np.isin(iou_thresholds, MAP_IOU_THRESHOLDS)
+
+    tp = match_predictions(data, iou_thresholds)
+    order = np.argsort(-data["pred_conf"], kind="stable")
+    tp, conf, pred_class = tp[order], data["pred_conf"][order], data["pred_class"][order]
+    above_conf = conf >= conf_threshold
+
+    names = dict(zip(data["class_ids"].tolist(), data["class_names"].tolist()))
+    classes = np.unique(data["gt_class"])
+    rows = []
+    for c in classes:
+        in_class = pred_class == c
+        n_gt = int((data["gt_class"] == c).sum())
+        tpc = np.cumsum(tp[in_class], axis=0)
+        fpc = np.cumsum(~tp[in_class], axis=0)
+        recall = tpc / (n_gt + EPS)
+        precision = tpc / (tpc + fpc + EPS)
+        if in_class.any():
+            ap = np.array([average_precision(recall[:, t], precision[:, t]) for t in range(len(iou_thresholds))])
+        else:
+            # Sans prédiction, l'interpolation relierait (0, 1) à (1, 0) et donnerait AP = 0.5
+            ap = np.zeros(len(iou_thresholds))
+
+        selected = in_class & above_conf
+        n_pred = int(selected.sum())
+        n_tp = int(tp[selected, i_req].sum())
+        p = n_tp / n_pred if n_pred else 0.0
+        r = n_tp / n_gt if n_gt else 0.0
+        rows.append({
+            "class_id": int(c),
+            "name": names.get(int(c), str(int(c))),
+            "instances": n_gt,
+            "predictions": n_pred,
+            "precision": p,
+            "recall": r,
+            "f1": 2 * p * r / (p + r) if p + r else 0.0,
+            "AP50": float(ap[i50]),
+            "AP50-95": float(ap[i_map].mean()),
+            "AP@iou": float(ap[i_req]),
+        })
+
+    def mean(key):
+        return float(np.mean([row[key] for row in rows])) if rows else 0.0
+
+    metrics = {
+        "conf_threshold": conf_threshold,
+        "iou_threshold": iou_threshold,
+        "images": int(len(data["images"]) - len(data["unreadable"])),
+        "unreadable_images": int(len(data["unreadable"])),
+        "instances": int(len(data["gt_class"])),
+        "predictions": int(above_conf.sum()),
+        "precision": mean("precision"),
+        "recall": mean("recall"),
+        "f1": mean("f1"),
+        "mAP50": mean("AP50"),
+        "mAP50-95": mean("AP50-95"),
+        "mAP@iou": mean("AP@iou"),
+    }
+    if per_class:
+        metrics["per_class"] = rows
+    return metrics
@@ -1,9 +1,9 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Request, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, StreamingResponse # Import StreamingResponse for potential downloads
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 import uuid
 from datetime import datetime
 import json
@@ -11,10 +11,13 @@ import os
 import mimetypes # Import mimetypes for file serving
 import stat # Import stat for file size
 
+from sqlalchemy import func, insert
 from sqlalchemy.orm import Session # Import Session
+from sqlalchemy.exc import IntegrityError
 from .celery_app import celery_app
 from .database import init_db, get_db # Import get_db
-from .models import TrainingJob, JobStatus, TrainedModel, ModelType # Import TrainedModel and ModelType
+from .models import TrainingJob, JobStatus, TrainedModel, ModelType, EvaluationJob, Dataset, DatasetFile, DatasetChunk, DatasetStatus # Import TrainedModel and ModelType
+from . import datasets, evaluation, resources
 
 # --- App Definition ---
 app = FastAPI(
@@ -39,7 +42,8 @@ app.mount("/static", StaticFiles(directory="/app/frontend/static"), name="static
 class YOLOTrainingRequest(BaseModel):
     name: str
     model: str = "yolov8n"  # yolov8n, yolov8s, yolov8m, yolov11n, yolov11s
-    dataset_path: str
+    dataset_path: Optional[str] = None
+    dataset_id: Optional[str] = None # Uploaded dataset, used in place of dataset_path
     epochs: int = 100
     batch_size: int = 16
     image_size: int = 640
@@ -56,6 +60,38 @@ class GemmaTrainingRequest(BaseModel):
     learning_rate: float = 2e-4
     max_length: int = 512
 
+class EvaluationRequest(BaseModel):
+    name: str
+    model_id: str
+    dataset_path: Optional[str] = None
+    dataset_id: Optional[str] = None
+    split: str = "val"
+    batch_size: int = 16
+    image_size: int = 640
+    workers: Optional[int] = None # CPU inference processes, defaults to half the cores
+
+class CalibrationRequest(BaseModel):
+    dataset_path: Optional[str] = None
+    dataset_id: Optional[str] = None
+    model: str = "yolov8n"
+    epochs: int = 1
+    batch_size: int = 16
+    image_size: int = 320
+    fraction: float = 0.1 # Share of the training split used by each benchmark run
+    concurrency_candidates: Optional[List[int]] = None # Defaults to 1, 2, 4... up to the core count
+
+class DatasetFileSpec(BaseModel):
+    path: str # Relative path inside the dataset, e.g. "train/images/0001.jpg" or "vehicles.zip"
+    size: int
+
+MISSING_CHUNKS_PAGE_SIZE = 100 # Incomplete files listed per dataset status response
+MAX_MISSING_CHUNKS_PAGE_SIZE = 1000
+
+class DatasetUploadRequest(BaseModel):
+    name: str
+    files: List[DatasetFileSpec]
+    chunk_size: int = datasets.DEFAULT_CHUNK_SIZE
+
 class JobResponse(BaseModel):
     job_id: str
     status: str
@@ -77,17 +113,33 @@ async def read_index():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+def resolve_dataset_path(dataset_path: Optional[str], dataset_id: Optional[str], db: Session) -> str:
+    """Return the on-disk dataset path, resolving an uploaded dataset id if one is given"""
+    if bool(dataset_path) == bool(dataset_id):
+        raise HTTPException(status_code=400, detail="Provide exactly one of 'dataset_path' or 'dataset_id'.")
+    if dataset_path:
+        return dataset_path
+
+    dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    if dataset.status != DatasetStatus.READY:
+        raise HTTPException(status_code=409, detail=f"Dataset is not ready (status: {dataset.status.value}).")
+    return dataset.path
+
 @app.post("/api/v1/training/yolo/", response_model=JobResponse)
 async def create_yolo_training_job(request: YOLOTrainingRequest, db: Session = Depends(get_db)):
     """Create a new YOLO training job"""
     job_id = str(uuid.uuid4())
+    config = request.dict()
+    config["dataset_path"] = resolve_dataset_path(request.dataset_path, request.dataset_id, db)
 
     # Create and save job record to database
     training_job = TrainingJob(
         id=job_id,
         name=request.name,
         type=ModelType.YOLO, # Use ModelType Enum
-        config=request.dict(),
+        config=config,
         status=JobStatus.PENDING, # Use JobStatus Enum
         created_at=datetime.utcnow()
     )
@@ -99,7 +151,7 @@ async def create_yolo_training_job(request: YOLOTrainingRequest, db: Session = D
     # Start Celery task
     task = celery_app.send_task(
         "backend.tasks.train_yolo_model",
-        args=[job_id, request.dict()],
+        args=[job_id, config],
         task_id=job_id
     )
 
@@ -269,6 +321,360 @@ async def delete_training_job(job_id: str, background_tasks: BackgroundTasks, db
     return {"job_id": job_id, "status": "queued_for_deletion", "message": "Job and associated files are scheduled for deletion."}
 
 
+def format_dataset(dataset: Dataset, db: Session, offset: int = 0, limit: int = 0) -> Dict[str, Any]:
+    """
+    Serialize a dataset with its upload progress.
+    Totals are computed in the database; the files still missing chunks (with their missing
+    indexes) are only listed one page at a time, since a dataset can declare many thousand files.
+    """
+    files_total, chunks_total = db.query(func.count(DatasetFile.id), func.coalesce(func.sum(DatasetFile.chunks_total), 0)).filter(
+        DatasetFile.dataset_id == dataset.id
+    ).one()
+    upload = {"files_total": files_total, "chunks_total": int(chunks_total), "chunks_received": int(chunks_total), "incomplete_files_total": 0, "incomplete_files": []}
+
+    # Once ingested, the chunk rows are dropped and every chunk counts as received
+    if dataset.status != DatasetStatus.READY:
+        received = db.query(DatasetChunk.file_path, func.count(DatasetChunk.id).label("received")).filter(
+            DatasetChunk.dataset_id == dataset.id
+        ).group_by(DatasetChunk.file_path).subquery()
+        received_count = func.coalesce(received.c.received, 0)
+        incomplete = db.query(DatasetFile, received_count).outerjoin(received, received.c.file_path == DatasetFile.path).filter(
+            DatasetFile.dataset_id == dataset.id, received_count < DatasetFile.chunks_total
+        )
+        upload["chunks_received"] = db.query(func.count(DatasetChunk.id)).filter(DatasetChunk.dataset_id == dataset.id).scalar()
+        upload["incomplete_files_total"] = incomplete.count()
+
+        page = incomplete.order_by(DatasetFile.path).offset(offset).limit(limit).all() if limit > 0 else []
+        got = {}
+        if page:
+            for file_path, index in db.query(DatasetChunk.file_path, DatasetChunk.index).filter(
+                DatasetChunk.dataset_id == dataset.id, DatasetChunk.file_path.in_([f.path for f, _ in page])
+            ):
+                got.setdefault(file_path, set()).add(index)
+        for dataset_file, chunks_received in page:
+            upload["incomplete_files"].append({
+                "path": dataset_file.path,
+                "size": dataset_file.size,
+                "chunks_total": dataset_file.chunks_total,
+                "chunks_received": chunks_received,
+                "missing_chunks": [i for i in range(dataset_file.chunks_total) if i not in got.get(dataset_file.path, set())],
+            })
+
+    return {
+        "dataset_id": str(dataset.id),
+        "name": dataset.name,
+        "status": dataset.status.value,
+        "chunk_size": dataset.chunk_size,
+        **upload,
+        "path": dataset.path,
+        "report": dataset.report,
+        "error_message": dataset.error_message,
+        "created_at": dataset.created_at.isoformat() if dataset.created_at else None,
+        "completed_at": dataset.completed_at.isoformat() if dataset.completed_at else None,
+    }
+
+@app.post("/api/v1/datasets/")
+async def create_dataset_upload(request: DatasetUploadRequest, db: Session = Depends(get_db)):
+    """
+    Start a chunked, resumable dataset upload.
+    Every file (archive or individual image/label) is declared up front with its size,
+    then sent chunk by chunk to PUT /api/v1/datasets/{dataset_id}/chunks/{index}.
+    """
+    if not request.files:
+        raise HTTPException(status_code=400, detail="At least one file must be declared.")
+    if not 0 < request.chunk_size <= datasets.MAX_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail=f"chunk_size must be between 1 and {datasets.MAX_CHUNK_SIZE} bytes.")
+
+    dataset_id = str(uuid.uuid4())
+    files = []
+    seen = set()
+    for file_spec in request.files:
+        try:
+            path = datasets.normalize_relative_path(file_spec.path)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if path in seen:
+            raise HTTPException(status_code=400, detail=f"File declared twice: {path}")
+        if file_spec.size < 0:
+            raise HTTPException(status_code=400, detail=f"Invalid size for {path}")
+        seen.add(path)
+        files.append({
+            "id": str(uuid.uuid4()),
+            "dataset_id": dataset_id,
+            "path": path,
+            "size": file_spec.size,
+            "chunks_total": datasets.chunk_count(file_spec.size, request.chunk_size),
+        })
+
+    dataset = Dataset(
+        id=dataset_id,
+        name=request.name,
+        status=DatasetStatus.UPLOADING,
+        chunk_size=request.chunk_size,
+        created_at=datetime.utcnow()
+    )
+    db.add(dataset)
+    db.execute(insert(DatasetFile), files)
+    db.commit()
+    db.refresh(dataset)
+    return format_dataset(dataset, db, limit=MISSING_CHUNKS_PAGE_SIZE)
+
+@app.put("/api/v1/datasets/{dataset_id}/chunks/{index}")
+async def upload_dataset_chunk(
+    dataset_id: str,
+    index: int,
+    request: Request,
+    file: str = Query(..., description="Declared relative path of the file this chunk belongs to"),
+    x_chunk_sha256: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload one chunk as the raw request body. The body is streamed to disk and hashed as it arrives.
+    If X-Chunk-SHA256 is sent, it is checked against the received data; when a chunk with that hash
+    is already stored, the body is not read at all and the existing chunk is reused.
+    """
+    dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    if dataset.status not in (DatasetStatus.UPLOADING, DatasetStatus.FAILED):
+        raise HTTPException(status_code=409, detail=f"Dataset no longer accepts uploads (status: {dataset.status.value}).")
+
+    try:
+        file_path = datasets.normalize_relative_path(file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    dataset_file = db.query(DatasetFile).filter(DatasetFile.dataset_id == dataset_id, DatasetFile.path == file_path).first()
+    if not dataset_file:
+        raise HTTPException(status_code=404, detail=f"File not declared in this dataset: {file_path}")
+    if not 0 <= index < dataset_file.chunks_total:
+        raise HTTPException(status_code=400, detail=f"Chunk index {index} out of range for {file_path}")
+    expected_size = datasets.expected_chunk_size(dataset_file.size, dataset.chunk_size, index)
+
+    if x_chunk_sha256 is not None:
+        x_chunk_sha256 = x_chunk_sha256.lower()
+        if not datasets.is_sha256(x_chunk_sha256):
+            raise HTTPException(status_code=400, detail="X-Chunk-SHA256 must be a hex-encoded SHA-256 digest (64 characters).")
+
+    stored_path = datasets.chunk_store_path(x_chunk_sha256) if x_chunk_sha256 else None
+    if stored_path and os.path.exists(stored_path) and os.path.getsize(stored_path) == expected_size:
+        sha256, deduplicated = x_chunk_sha256, True
+        datasets.touch_chunk(sha256)
+    else:
+        try:
+            sha256, deduplicated = await datasets.receive_chunk(request.stream(), expected_size, x_chunk_sha256)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def record_chunk():
+        chunk = db.query(DatasetChunk).filter(
+            DatasetChunk.dataset_id == dataset_id,
+            DatasetChunk.file_path == file_path,
+            DatasetChunk.index == index
+        ).first()
+        if chunk is None:
+            chunk = DatasetChunk(id=str(uuid.uuid4()), dataset_id=dataset_id, file_path=file_path, index=index)
+        chunk.sha256 = sha256
+        chunk.size = expected_size
+        chunk.created_at = datetime.utcnow()
+        db.add(chunk)
+        db.commit()
+
+    try:
+        record_chunk()
+    except IntegrityError:
+        # The same chunk was recorded concurrently: overwrite it
+        db.rollback()
+        record_chunk()
+
+    return {"dataset_id": dataset_id, "file": file_path, "index": index, "sha256": sha256, "size": expected_size, "deduplicated": deduplicated}
+
+@app.post("/api/v1/datasets/{dataset_id}/complete")
+async def complete_dataset_upload(dataset_id: str, db: Session = Depends(get_db)):
+    """Check that every chunk was received, then queue extraction and validation on a worker"""
+    dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    if dataset.status not in (DatasetStatus.UPLOADING, DatasetStatus.FAILED):
+        raise HTTPException(status_code=409, detail=f"Dataset cannot be completed (status: {dataset.status.value}).")
+
+    formatted = format_dataset(dataset, db, limit=MISSING_CHUNKS_PAGE_SIZE)
+    if formatted["incomplete_files_total"]:
+        raise HTTPException(status_code=409, detail={
+            "message": "Upload incomplete",
+            "chunks_missing": formatted["chunks_total"] - formatted["chunks_received"],
+            "incomplete_files_total": formatted["incomplete_files_total"],
+            # First page only: GET /api/v1/datasets/{dataset_id}?offset=... lists the others
+            "missing_chunks": {f["path"]: f["missing_chunks"] for f in formatted["incomplete_files"]},
+        })
+
+    dataset.status = DatasetStatus.PROCESSING
+    dataset.error_message = None
+    db.add(dataset)
+    db.commit()
+
+    celery_app.send_task("backend.tasks.ingest_dataset", args=[dataset_id])
+
+    return {"dataset_id": dataset_id, "status": dataset.status.value, "message": f"Dataset '{dataset.name}' queued for ingestion"}
+
+@app.get("/api/v1/datasets/")
+async def list_datasets(db: Session = Depends(get_db)):
+    """List uploaded datasets"""
+    formatted_datasets = [format_dataset(dataset, db) for dataset in db.query(Dataset).all()]
+    formatted_datasets.sort(key=lambda x: x['created_at'] if x['created_at'] else '', reverse=True)
+    return {"datasets": formatted_datasets}
+
+@app.get("/api/v1/datasets/{dataset_id}")
+async def get_dataset(
+    dataset_id: str,
+    offset: int = Query(0, ge=0, description="First incomplete file to list"),
+    limit: int = Query(MISSING_CHUNKS_PAGE_SIZE, ge=0, le=MAX_MISSING_CHUNKS_PAGE_SIZE, description="Number of incomplete files to list"),
+    db: Session = Depends(get_db)
+):
+    """Get dataset status, upload progress (a page of the files still missing chunks) and validation report"""
+    dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return format_dataset(dataset, db, offset=offset, limit=limit)
+
+@app.delete("/api/v1/datasets/{dataset_id}")
+async def delete_dataset(dataset_id: str, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """
+    Delete a dataset: its extracted files, its chunk records and the stored chunks no other dataset uses.
+    This is a permanent action.
+    """
+    dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    if dataset.status == DatasetStatus.PROCESSING:
+        raise HTTPException(status_code=409, detail="Dataset is being ingested; wait for it to finish before deleting it.")
+
+    background_tasks.add_task(celery_app.send_task, "backend.tasks.delete_dataset", args=[dataset_id])
+
+    return {"dataset_id": dataset_id, "status": "queued_for_deletion", "message": "Dataset and associated files are scheduled for deletion."}
+
+def format_evaluation(evaluation_job: EvaluationJob) -> Dict[str, Any]:
+    return {
+        "evaluation_id": str(evaluation_job.id),
+        "name": evaluation_job.name,
+        "model_id": str(evaluation_job.model_id),
+        "status": evaluation_job.status.value,
+        "progress": evaluation_job.progress,
+        "config": evaluation_job.config,
+        "results": evaluation_job.results,
+        "metrics": evaluation_job.results.get('final_metrics', {}) if evaluation_job.results else {},
+        "error_message": evaluation_job.error_message,
+        "created_at": evaluation_job.created_at.isoformat() if evaluation_job.created_at else None,
+        "started_at": evaluation_job.started_at.isoformat() if evaluation_job.started_at else None,
+        "completed_at": evaluation_job.completed_at.isoformat() if evaluation_job.completed_at else None,
+    }
+
+@app.post("/api/v1/evaluations/", response_model=JobResponse)
+async def create_evaluation_job(request: EvaluationRequest, db: Session = Depends(get_db)):
+    """Evaluate an existing trained model against a dataset split without retraining"""
+    trained_model = db.query(TrainedModel).filter(TrainedModel.id == request.model_id).first()
+    if not trained_model:
+        raise HTTPException(status_code=404, detail="Model not found")
+    if trained_model.type != ModelType.YOLO:
+        raise HTTPException(status_code=400, detail="Only YOLO models can be evaluated.")
+
+    evaluation_id = str(uuid.uuid4())
+    config = request.dict()
+    config["dataset_path"] = resolve_dataset_path(request.dataset_path, request.dataset_id, db)
+
+    evaluation_job = EvaluationJob(
+        id=evaluation_id,
+        name=request.name,
+        model_id=request.model_id,
+        config=config,
+        status=JobStatus.PENDING,
+        created_at=datetime.utcnow()
+    )
+    db.add(evaluation_job)
+    db.commit()
+
+    celery_app.send_task(
+        "backend.tasks.evaluate_yolo_model",
+        args=[evaluation_id, config],
+        task_id=evaluation_id
+    )
+
+    return JobResponse(
+        job_id=evaluation_id,
+        name=request.name,
+        status="pending",
+        message=f"Evaluation job '{request.name}' created successfully"
+    )
+
+@app.get("/api/v1/evaluations/")
+async def list_evaluation_jobs(db: Session = Depends(get_db)):
+    """List all evaluation jobs"""
+    formatted_evaluations = [format_evaluation(e) for e in db.query(EvaluationJob).all()]
+    formatted_evaluations.sort(key=lambda x: x['created_at'] if x['created_at'] else '', reverse=True)
+    return {"evaluations": formatted_evaluations}
+
+@app.get("/api/v1/evaluations/{evaluation_id}")
+async def get_evaluation_job(evaluation_id: str, db: Session = Depends(get_db)):
+    """Get evaluation job status and default metrics"""
+    evaluation_job = db.query(EvaluationJob).filter(EvaluationJob.id == evaluation_id).first()
+    if not evaluation_job:
+        raise HTTPException(status_code=404, detail="Evaluation not found")
+    return format_evaluation(evaluation_job)
+
+@app.get("/api/v1/evaluations/{evaluation_id}/metrics")
+def get_evaluation_metrics(
+    evaluation_id: str,
+    conf: float = Query(0.25, ge=0.0, le=1.0),
+    iou: float = Query(0.5, gt=0.0, le=1.0),
+    per_class: bool = False,
+    db: Session = Depends(get_db)
+):
+    """
+    Recompute metrics at any confidence/IoU threshold from the cached predictions.
+    No inference is re-run. Plain `def` so loading and computing run in the threadpool, off the event loop.
+    """
+    evaluation_job = db.query(EvaluationJob).filter(EvaluationJob.id == evaluation_id).first()
+    if not evaluation_job:
+        raise HTTPException(status_code=404, detail="Evaluation not found")
+    if evaluation_job.status != JobStatus.COMPLETED or not evaluation_job.predictions_path:
+        raise HTTPException(status_code=409, detail=f"Evaluation is not completed (status: {evaluation_job.status.value}).")
+    if not os.path.exists(evaluation_job.predictions_path):
+        raise HTTPException(status_code=404, detail=f"Cached predictions not found on server at {evaluation_job.predictions_path}.")
+
+    data = evaluation.load_predictions(evaluation_job.predictions_path)
+    return {"evaluation_id": evaluation_id, "metrics": evaluation.compute_metrics(data, conf, iou, per_class)}
+
+@app.post("/api/v1/workers/calibration")
+async def start_worker_calibration(request: CalibrationRequest, db: Session = Depends(get_db)):
+    """
+    Benchmark several core layouts (concurrent jobs x dataloader workers) with short CPU trainings.
+    The best layout per concurrency is stored and then used by every training job on this host.
+    Run it while the worker is idle.
+    """
+    config = request.dict()
+    config["dataset_path"] = resolve_dataset_path(request.dataset_path, request.dataset_id, db)
+    task = celery_app.send_task("backend.tasks.calibrate_worker_resources", args=[config])
+    return {"task_id": task.id, "status": "pending", "message": "Worker calibration started"}
+
+@app.get("/api/v1/workers/calibration")
+async def get_worker_calibration():
+    """Return the stored calibration (best layouts and last run measurements)"""
+    return resources.load_calibration()
+
+@app.get("/api/v1/workers/calibration/{task_id}")
+async def get_worker_calibration_task(task_id: str):
+    """Get the progress or result of a calibration run"""
+    task_result = celery_app.AsyncResult(task_id)
+    info = task_result.info if isinstance(task_result.info, dict) else {}
+    return {
+        "task_id": task_id,
+        "state": task_result.state,
+        "progress": 100 if task_result.state == "SUCCESS" else info.get('progress', 0),
+        "message": info.get('message'),
+        "results": info.get('results'),
+        "error": info.get('error') or (str(task_result.info) if task_result.state == "FAILURE" else None),
+    }
+
+
 @app.get("/api/v1/models/")
 async def list_trained_models(db: Session = Depends(get_db)):
     """List all trained models from the database"""
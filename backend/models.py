@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Text, Integer, Float, Enum
+from sqlalchemy import Column, String, DateTime, Text, Integer, BigInteger, Float, Enum, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID, JSON
 from .database import Base
 import uuid
@@ -16,6 +16,12 @@ class ModelType(enum.Enum):
     YOLO = "yolo"
     GEMMA = "gemma"
 
+class DatasetStatus(enum.Enum):
+    UPLOADING = "uploading"
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+
 class TrainingJob(Base):
     __tablename__ = "training_jobs"
 
@@ -41,3 +47,56 @@ class TrainedModel(Base):
     model_path = Column(String(500), nullable=False)
     metrics = Column(JSON)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+class EvaluationJob(Base):
+    __tablename__ = "evaluation_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    name = Column(String(255), nullable=False)
+    model_id = Column(UUID(as_uuid=True), nullable=False)
+    status = Column(Enum(JobStatus), default=JobStatus.PENDING)
+    config = Column(JSON)
+    results = Column(JSON)
+    predictions_path = Column(String(500))  # Cache .npz des prédictions brutes
+    error_message = Column(Text)
+    progress = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    completed_at = Column(DateTime)
+
+class Dataset(Base):
+    __tablename__ = "datasets"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    name = Column(String(255), nullable=False)
+    status = Column(Enum(DatasetStatus), default=DatasetStatus.UPLOADING)
+    chunk_size = Column(Integer, nullable=False)
+    path = Column(String(500))  # Racine du dataset extrait (contient train/ et val/)
+    report = Column(JSON)  # Résumé des fichiers assemblés et rapport de validation
+    error_message = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime)
+
+class DatasetFile(Base):
+    """Fichier déclaré à la création d'un dataset (une ligne par fichier, pour les datasets d'images individuelles)."""
+    __tablename__ = "dataset_files"
+    __table_args__ = (UniqueConstraint("dataset_id", "path"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    dataset_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    path = Column(String(500), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    chunks_total = Column(Integer, nullable=False)
+    sha256 = Column(String(64))  # Empreinte du fichier assemblé, renseignée à l'ingestion
+
+class DatasetChunk(Base):
+    __tablename__ = "dataset_chunks"
+    __table_args__ = (UniqueConstraint("dataset_id", "file_path", "index"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    dataset_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    file_path = Column(String(500), nullable=False)
+    index = Column(Integer, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
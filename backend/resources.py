@@ -0,0 +1,338 @@
+"""
+Répartition des cœurs CPU entre les tâches Celery exécutées en parallèle.
+
+Sans limite, torch, OpenMP et les workers du dataloader d'Ultralytics
+supposent chacun disposer de tous les cœurs de la machine; plusieurs
+entraînements simultanés se retrouvent alors en sur-souscription. Chaque
+processus enfant de Celery (un « slot ») reçoit ici un sous-ensemble de cœurs
+dédié, sur lequel il est épinglé, ainsi qu'un nombre de threads intra-op /
+inter-op et de workers de dataloader adapté. Le mode calibration mesure le
+débit réel de plusieurs répartitions et enregistre la meilleure pour l'hôte.
+"""
+import os
+import json
+import time
+import socket
+import logging
+import tempfile
+from datetime import datetime
+from queue import Empty
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_PATH = os.getenv("RESOURCE_CALIBRATION_PATH", "/app/models/.resource_calibration.json")
+HOST_CORES_ENV = "TRAINING_HOST_CORES"
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+# --- Planification ---
+
+def available_cores() -> List[int]:
+    """
+    Cœurs utilisables par le worker.
+
+    La liste est mémorisée dans l'environnement au premier épinglage, pour que
+    les processus déjà restreints à leur slot (et leurs enfants) connaissent
+    toujours l'ensemble des cœurs de l'hôte.
+    """
+    if os.getenv(HOST_CORES_ENV):
+        return [int(c) for c in os.environ[HOST_CORES_ENV].split(",")]
+
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+
+    # Respecter un éventuel quota CPU du conteneur (cgroup v2, ex: `docker run --cpus=4`)
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = cores[:max(1, -(-int(quota) // int(period)))]
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+def worker_concurrency() -> int:
+    return max(1, int(os.getenv("WORKER_CONCURRENCY", "1")))
+
+
+def current_slot() -> int:
+    """Index du processus enfant Celery courant (0 hors d'un worker prefork)."""
+    try:
+        from billiard.process import current_process
+        return int(getattr(current_process(), "index", 0) or 0)
+    except ImportError:
+        return 0
+
+
+def calibration_key(cores_total: int, concurrency: int, host: Optional[str] = None) -> str:
+    """
+    Clé d'une répartition calibrée. Le fichier de calibration est sur un volume
+    partagé : deux hôtes au même nombre de cœurs n'ont pas le même débit.
+    """
+    return f"{host or socket.gethostname()}:{cores_total}:{concurrency}"
+
+
+def load_calibration() -> Dict[str, Any]:
+    if not os.path.exists(CALIBRATION_PATH):
+        return {}
+    try:
+        with open(CALIBRATION_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logger.warning(f"Fichier de calibration illisible : {CALIBRATION_PATH}")
+        return {}
+
+
+def default_dataloader_workers(cores_per_slot: int) -> int:
+    """Un worker de dataloader pour quatre cœurs (au moins un dès deux cœurs), le reste pour le calcul."""
+    if cores_per_slot < 2:
+        return 0
+    return max(1, cores_per_slot // 4)
+
+
+def plan_resources(
+    concurrency: Optional[int] = None,
+    slot: Optional[int] = None,
+    dataloader_workers: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Calcule la répartition des ressources d'un slot.
+
+    Les cœurs de l'hôte sont divisés en `concurrency` groupes contigus. La
+    répartition dataloader/calcul provient de la calibration de l'hôte si elle
+    existe, sinon d'une heuristique.
+    """
+    cores = available_cores()
+    concurrency = concurrency or worker_concurrency()
+    slot = (current_slot() if slot is None else slot) % concurrency
+    per_slot = max(1, len(cores) // concurrency)
+    start = (slot * per_slot) % len(cores)
+    slot_cores = cores[start:start + per_slot]
+
+    source = "heuristic"
+    if dataloader_workers is None:
+        calibrated = load_calibration().get("layouts", {}).get(calibration_key(len(cores), concurrency))
+        if calibrated:
+            dataloader_workers = calibrated["dataloader_workers"]
+            source = "calibration"
+        else:
+            dataloader_workers = default_dataloader_workers(len(slot_cores))
+    else:
+        source = "explicit"
+    dataloader_workers = max(0, min(dataloader_workers, len(slot_cores) - 1))
+
+    return {
+        "host": socket.gethostname(),
+        "cores_total": len(cores),
+        "concurrency": concurrency,
+        "slot": slot,
+        "cores": slot_cores,
+        "intra_op_threads": max(1, len(slot_cores) - dataloader_workers),
+        "inter_op_threads": 1,
+        "dataloader_workers": dataloader_workers,
+        "source": source,
+    }
+
+
+def apply_plan(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Épingle le processus sur les cœurs du slot et limite les threads de torch/OpenMP/BLAS."""
+    os.environ.setdefault(HOST_CORES_ENV, ",".join(str(c) for c in available_cores()))
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(plan["intra_op_threads"])
+
+    if hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, plan["cores"])
+        except OSError as e:
+            logger.warning(f"Impossible d'épingler le processus sur les cœurs {plan['cores']} : {e}")
+
+    import torch
+    torch.set_num_threads(plan["intra_op_threads"])
+    try:
+        torch.set_num_interop_threads(plan["inter_op_threads"])
+    except RuntimeError:
+        # Ne peut être modifié qu'une fois, avant tout travail parallèle inter-op
+        pass
+    return plan
+
+
+def keep_dataloader_workers(model, workers: int) -> None:
+    """
+    Applique le nombre de workers de dataloader prévu, y compris sur CPU.
+
+    Le `BaseTrainer` d'Ultralytics force `workers = 0` quand l'entraînement
+    se fait sur CPU : les cœurs réservés au dataloader resteraient inactifs.
+    Le rappel `on_pretrain_routine_start`, exécuté avant la création des
+    dataloaders, rétablit la valeur du slot.
+    """
+    def restore_workers(trainer):
+        trainer.args.workers = workers
+
+    model.add_callback("on_pretrain_routine_start", restore_workers)
+
+
+# --- Calibration ---
+
+def _run_benchmark(plan: Dict[str, Any], config: Dict[str, Any]) -> float:
+    """Court entraînement CPU avec la répartition donnée; retourne le débit en images/s."""
+    apply_plan(plan)
+    from ultralytics import YOLO
+
+    model = YOLO(f"{config.get('model', 'yolov8n')}.pt")
+    keep_dataloader_workers(model, plan["dataloader_workers"])
+    epochs = config.get("epochs", 1)
+    with tempfile.TemporaryDirectory() as project:
+        started = time.perf_counter()
+        model.train(
+            data=config["data"],
+            epochs=epochs,
+            imgsz=config.get("image_size", 320),
+            batch=config.get("batch_size", 16),
+            fraction=config.get("fraction", 0.1),
+            workers=plan["dataloader_workers"],
+            device="cpu",
+            project=project,
+            name=f"slot{plan['slot']}",
+            val=False,
+            plots=False,
+            verbose=False,
+        )
+        elapsed = time.perf_counter() - started
+    images = len(model.trainer.train_loader.dataset) * epochs
+    return images / elapsed if elapsed else 0.0
+
+
+def _benchmark_process(plan: Dict[str, Any], config: Dict[str, Any], results) -> None:
+    """Point d'entrée d'un processus de mesure : renvoie (slot, débit, erreur) au parent."""
+    try:
+        results.put((plan["slot"], _run_benchmark(plan, config), None))
+    except Exception as e:
+        results.put((plan["slot"], 0.0, f"{type(e).__name__}: {e}"))
+
+
+def _run_benchmarks(plans: List[Dict[str, Any]], config: Dict[str, Any]) -> List[float]:
+    """
+    Lance une mesure par slot, toutes en même temps, et retourne leurs débits.
+
+    Les enfants d'un worker Celery sont daemoniques : ni `multiprocessing` ni
+    `concurrent.futures` ne peuvent y créer de processus. On passe donc par
+    billiard, et les processus de mesure sont non daemoniques car le
+    dataloader d'Ultralytics lance lui-même ses workers.
+    """
+    from billiard import get_context
+
+    ctx = get_context("spawn")
+    results = ctx.Queue()
+    processes = []
+    for plan in plans:
+        process = ctx.Process(target=_benchmark_process, args=(plan, config, results))
+        process.daemon = False
+        process.start()
+        processes.append(process)
+
+    throughputs, errors = {}, []
+    try:
+        while len(throughputs) < len(processes):
+            try:
+                slot, throughput, error = results.get(timeout=5)
+            except Empty:
+                # Un processus tué (ex: OOM) ne renverra jamais de résultat
+                if not any(p.is_alive() for p in processes):
+                    try:
+                        slot, throughput, error = results.get(timeout=1)
+                    except Empty:
+                        raise RuntimeError("Un processus de mesure s'est arrêté sans résultat")
+                else:
+                    continue
+            throughputs[slot] = throughput
+            if error:
+                errors.append(f"slot {slot} : {error}")
+    finally:
+        for process in processes:
+            if len(throughputs) < len(processes) and process.is_alive():
+                process.terminate()
+            process.join()
+
+    if errors:
+        raise RuntimeError("Échec de la mesure (" + "; ".join(errors) + ")")
+    return [throughputs[plan["slot"]] for plan in plans]
+
+
+def candidate_layouts(cores_total: int, concurrency_candidates: Optional[List[int]] = None) -> List[Dict[str, int]]:
+    """Couples (concurrence, workers de dataloader) à mesurer pour un hôte."""
+    if not concurrency_candidates:
+        concurrency_candidates = []
+        c = 1
+        while c <= cores_total:
+            concurrency_candidates.append(c)
+            c *= 2
+    layouts = []
+    for concurrency in sorted(set(c for c in concurrency_candidates if 1 <= c <= cores_total)):
+        per_slot = cores_total // concurrency
+        for workers in sorted({0, 1, per_slot // 4, per_slot // 2}):
+            if workers < per_slot:
+                layouts.append({"concurrency": concurrency, "dataloader_workers": workers})
+    return layouts
+
+
+def calibrate(config: Dict[str, Any], progress_callback=None) -> Dict[str, Any]:
+    """
+    Mesure le débit total de l'hôte pour chaque répartition candidate.
+
+    Pour une concurrence `c`, `c` entraînements courts sont lancés en même
+    temps, chacun sur son propre slot, et leurs débits sont additionnés. La
+    meilleure répartition de chaque concurrence est enregistrée dans
+    `CALIBRATION_PATH` et sera utilisée par `plan_resources`.
+    À lancer sur un worker inactif pour que les mesures soient fiables.
+    """
+    cores_total = len(available_cores())
+    layouts = candidate_layouts(cores_total, config.get("concurrency_candidates"))
+    measurements = []
+    for done, layout in enumerate(layouts):
+        plans = [
+            plan_resources(layout["concurrency"], slot, layout["dataloader_workers"])
+            for slot in range(layout["concurrency"])
+        ]
+        throughputs = _run_benchmarks(plans, config)
+        measurement = {
+            **layout,
+            "intra_op_threads": plans[0]["intra_op_threads"],
+            "inter_op_threads": plans[0]["inter_op_threads"],
+            "images_per_second": sum(throughputs),
+        }
+        measurements.append(measurement)
+        logger.info(f"Calibration : {measurement}")
+        if progress_callback:
+            progress_callback(done + 1, len(layouts))
+
+    host = socket.gethostname()
+    calibration = load_calibration()
+    calibration.setdefault("layouts", {})
+    best_per_concurrency = {}
+    for measurement in measurements:
+        best = best_per_concurrency.get(measurement["concurrency"])
+        if best is None or measurement["images_per_second"] > best["images_per_second"]:
+            best_per_concurrency[measurement["concurrency"]] = measurement
+    for concurrency, best in best_per_concurrency.items():
+        calibration["layouts"][calibration_key(cores_total, concurrency, host)] = best
+
+    best_overall = max(measurements, key=lambda m: m["images_per_second"]) if measurements else None
+    last_run = {
+        "host": host,
+        "cores_total": cores_total,
+        "recommended_concurrency": best_overall["concurrency"] if best_overall else 1,
+        "measurements": measurements,
+        "calibrated_at": datetime.utcnow().isoformat(),
+    }
+    calibration.setdefault("last_runs", {})[host] = last_run
+
+    os.makedirs(os.path.dirname(CALIBRATION_PATH), exist_ok=True)
+    tmp_path = f"{CALIBRATION_PATH}.{host}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(calibration, f, indent=2)
+    os.replace(tmp_path, CALIBRATION_PATH)
+    return last_run
@@ -8,11 +8,12 @@ from typing import Dict, Any
 from datetime import datetime
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import create_engine
-from .models import TrainingJob, TrainedModel, JobStatus, ModelType
+from .models import TrainingJob, TrainedModel, EvaluationJob, JobStatus, ModelType, Dataset, DatasetFile, DatasetChunk, DatasetStatus
+from . import datasets, evaluation, resources
 from .database import Base
-import yaml
 import shutil
 import json
+import time
 from billiard.exceptions import WorkerLostError
 
 # Configuration du logging
@@ -76,26 +77,16 @@ def train_yolo_model(self, job_id: str, config: Dict[str, Any]):
             meta={'status': 'loading_model', 'progress': 10, 'message': f'Chargement du modèle {model_version}...'}
         )
 
+        # Répartir les cœurs entre les tâches simultanées du worker (calibration de l'hôte si disponible)
+        resource_plan = resources.apply_plan(resources.plan_resources())
+        logger.info(f"Répartition des ressources : {resource_plan}")
+
         logger.info(f"Chargement du modèle {model_version}")
         model = YOLO(f"{model_version}.pt")
+        resources.keep_dataloader_workers(model, resource_plan['dataloader_workers'])
 
         # Préparer dataset.yaml
-        dataset_config = {
-            'train': os.path.join(dataset_path, 'train'),
-            'val': os.path.join(dataset_path, 'val'),
-            'nc': 1,
-            'names': ['vehicle']  # par défaut
-        }
-        dataset_yaml_path = os.path.join(dataset_path, 'dataset.yaml')
-        if os.path.exists(dataset_yaml_path):
-            with open(dataset_yaml_path, 'r') as f:
-                loaded_dataset_config = yaml.safe_load(f)
-                dataset_config['nc'] = loaded_dataset_config.get('nc', dataset_config['nc'])
-                dataset_config['names'] = loaded_dataset_config.get('names', dataset_config['names'])
-
-        dataset_config_path = os.path.join(output_dir, 'dataset.yaml')
-        with open(dataset_config_path, 'w') as f:
-            yaml.dump(dataset_config, f)
+        dataset_config_path = datasets.write_training_config(dataset_path, output_dir)
 
         self.update_state(
             state='PROGRESS',
@@ -103,6 +94,7 @@ def train_yolo_model(self, job_id: str, config: Dict[str, Any]):
         )
 
         # Lancer l'entraînement
+        training_started = time.perf_counter()
         results = model.train(
             data=dataset_config_path,
             epochs=epochs,
@@ -110,11 +102,25 @@ def train_yolo_model(self, job_id: str, config: Dict[str, Any]):
             batch=batch_size,
             lr0=learning_rate,
             device=device,
+            workers=resource_plan['dataloader_workers'],
             project=output_dir,
             name='training',
             exist_ok=True,
             verbose=True,
         )
+        training_seconds = time.perf_counter() - training_started
+
+        # Débit mesuré (images d'entraînement traitées par seconde, validations par époque comprises)
+        trainer = getattr(model, 'trainer', None)
+        epochs_run = getattr(trainer, 'epoch', epochs - 1) + 1
+        train_images = len(trainer.train_loader.dataset) if trainer and getattr(trainer, 'train_loader', None) else 0
+        throughput = {
+            'training_seconds': training_seconds,
+            'epochs_run': epochs_run,
+            'train_images': train_images,
+            'dataloader_workers': trainer.train_loader.num_workers if trainer and getattr(trainer, 'train_loader', None) else 0,
+            'images_per_second': train_images * epochs_run / training_seconds if training_seconds else 0.0,
+        }
 
         # Validation
         self.update_state(
@@ -159,6 +165,8 @@ def train_yolo_model(self, job_id: str, config: Dict[str, Any]):
             'epochs_completed': epochs,
             'final_metrics': final_metrics,
             'training_config': config,
+            'resource_plan': resource_plan,
+            'throughput': throughput,
             'completed_at': datetime.utcnow().isoformat()
         }
         report_path = os.path.join(output_dir, f"{job_id}_report.json")
@@ -225,6 +233,118 @@ def train_yolo_model(self, job_id: str, config: Dict[str, Any]):
         if db.is_active:
             db.close()
 
+@celery_app.task(bind=True)
+def evaluate_yolo_model(self, evaluation_id: str, config: Dict[str, Any]):
+    """Évaluer un modèle YOLO entraîné sur un dataset et mettre ses prédictions en cache"""
+
+    db = SessionLocal()
+    evaluation_job = None
+    try:
+        evaluation_job = db.query(EvaluationJob).filter(EvaluationJob.id == evaluation_id).first()
+        if not evaluation_job:
+            raise ValueError(f"Évaluation {evaluation_id} non trouvée en base de données.")
+
+        evaluation_job.status = JobStatus.RUNNING
+        evaluation_job.started_at = datetime.utcnow()
+        db.add(evaluation_job)
+        db.commit()
+
+        trained_model = db.query(TrainedModel).filter(TrainedModel.id == evaluation_job.model_id).first()
+        if not trained_model or not os.path.exists(trained_model.model_path):
+            raise FileNotFoundError(f"Modèle {evaluation_job.model_id} introuvable.")
+
+        split_dir = os.path.join(config["dataset_path"], config.get("split", "val"))
+        if not os.path.isdir(split_dir):
+            raise FileNotFoundError(f"Split du jeu de données non trouvé : {split_dir}")
+        image_paths = datasets.list_images(split_dir)
+        if not image_paths:
+            raise ValueError(f"Aucune image trouvée dans {split_dir}")
+
+        cores = len(resources.plan_resources()["cores"])
+        workers = config.get("workers") or max(1, cores // 2)
+        threads_per_worker = max(1, cores // workers)
+
+        self.update_state(
+            state='PROGRESS',
+            meta={'status': 'predicting', 'progress': 5, 'message': f"Inférence sur {len(image_paths)} images ({workers} processus)..."}
+        )
+
+        def report_progress(done, total):
+            progress = 5 + int(85 * done / total)
+            self.update_state(
+                state='PROGRESS',
+                meta={'status': 'predicting', 'progress': progress, 'message': f"Inférence : lot {done}/{total}"}
+            )
+
+        predictions = evaluation.run_inference(
+            trained_model.model_path,
+            image_paths,
+            image_size=config.get("image_size", 640),
+            batch_size=config.get("batch_size", 16),
+            workers=workers,
+            threads_per_worker=threads_per_worker,
+            progress_callback=report_progress,
+        )
+
+        self.update_state(
+            state='PROGRESS',
+            meta={'status': 'caching', 'progress': 92, 'message': "Enregistrement des prédictions..."}
+        )
+        ground_truth = evaluation.load_ground_truth(image_paths, skip=predictions["unreadable"])
+        predictions_path = evaluation.predictions_path(evaluation_id)
+        evaluation.save_predictions(predictions_path, image_paths, predictions["names"], predictions, ground_truth)
+        metrics = evaluation.compute_metrics(evaluation.load_predictions(predictions_path))
+
+        results = {
+            'evaluation_id': evaluation_id,
+            'model_id': str(trained_model.id),
+            'predictions_path': predictions_path,
+            'images': len(image_paths),
+            'unreadable_images': len(predictions["unreadable"]),
+            'cached_predictions': int(len(predictions["pred_conf"])),
+            'inference_seconds': predictions["inference_seconds"],
+            'images_per_second': len(image_paths) / predictions["inference_seconds"] if predictions["inference_seconds"] else 0.0,
+            'workers': workers,
+            'threads_per_worker': threads_per_worker,
+            'final_metrics': metrics,
+            'evaluation_config': config,
+            'completed_at': datetime.utcnow().isoformat()
+        }
+
+        evaluation_job.status = JobStatus.COMPLETED
+        evaluation_job.progress = 100
+        evaluation_job.predictions_path = predictions_path
+        evaluation_job.results = results
+        evaluation_job.completed_at = datetime.utcnow()
+        db.add(evaluation_job)
+        db.commit()
+        logger.info(f"Évaluation {evaluation_id} terminée avec succès")
+
+        return {
+            'status': 'completed',
+            'progress': 100,
+            'message': "Évaluation du modèle terminée avec succès",
+            'results': results
+        }
+
+    except Exception as e:
+        import traceback
+        logger.error(f"L'évaluation {evaluation_id} a échoué : {str(e)}")
+        logger.error(traceback.format_exc())
+        if evaluation_job:
+            evaluation_job.status = JobStatus.FAILED
+            evaluation_job.error_message = str(e)
+            evaluation_job.completed_at = datetime.utcnow()
+            db.add(evaluation_job)
+            db.commit()
+        return {
+            'status': 'failed',
+            'error': str(e),
+            'message': f"L'évaluation a échoué : {str(e)}"
+        }
+    finally:
+        db.close()
+
 @celery_app.task
 def delete_job_from_db(job_id: str):
     """Supprime une tâche et les modèles associés de la base de données et du disque."""
@@ -257,3 +377,174 @@ def delete_job_from_db(job_id: str):
     finally:
         db.close()
 
+@celery_app.task(bind=True)
+def ingest_dataset(self, dataset_id: str):
+    """Assemble les morceaux téléversés, extrait les archives et valide le dataset."""
+    db = SessionLocal()
+    dataset = None
+    try:
+        dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+        if not dataset:
+            raise ValueError(f"Dataset {dataset_id} non trouvé en base de données.")
+
+        workers = len(resources.plan_resources()["cores"])
+        directory = datasets.dataset_dir(dataset_id)
+        # Repartir d'un dossier propre si une ingestion précédente a échoué
+        datasets.remove_dataset_dir(dataset_id)
+        os.makedirs(directory, exist_ok=True)
+
+        self.update_state(
+            state='PROGRESS',
+            meta={'status': 'assembling', 'progress': 10, 'message': "Assemblage des fichiers téléversés..."}
+        )
+
+        chunks = (
+            db.query(DatasetChunk)
+            .filter(DatasetChunk.dataset_id == dataset_id)
+            .order_by(DatasetChunk.file_path, DatasetChunk.index)
+            .all()
+        )
+        hashes_by_file = {}
+        for chunk in chunks:
+            hashes_by_file.setdefault(chunk.file_path, []).append(chunk.sha256)
+
+        files_report = {'count': 0, 'bytes': 0, 'archives': []}
+        archives = []
+        dataset_files = db.query(DatasetFile).filter(DatasetFile.dataset_id == dataset_id).order_by(DatasetFile.path).all()
+        for dataset_file in dataset_files:
+            hashes = hashes_by_file.get(dataset_file.path, [])
+            if len(hashes) != dataset_file.chunks_total:
+                raise ValueError(f"Morceaux manquants pour le fichier {dataset_file.path}.")
+
+            destination = os.path.join(directory, dataset_file.path)
+            dataset_file.sha256 = datasets.assemble_file(hashes, destination)
+            files_report['count'] += 1
+            files_report['bytes'] += dataset_file.size
+            if datasets.is_archive(dataset_file.path):
+                files_report['archives'].append({'path': dataset_file.path, 'size': dataset_file.size, 'sha256': dataset_file.sha256})
+                archives.append(destination)
+
+        self.update_state(
+            state='PROGRESS',
+            meta={'status': 'extracting', 'progress': 40, 'message': "Extraction des archives..."}
+        )
+        for archive_path in archives:
+            logger.info(f"Extraction de l'archive {archive_path}")
+            datasets.extract_archive(archive_path, directory, workers=workers)
+            os.remove(archive_path)
+
+        self.update_state(
+            state='PROGRESS',
+            meta={'status': 'validating', 'progress': 70, 'message': "Validation des images et annotations..."}
+        )
+        root = datasets.find_dataset_root(directory)
+        validation_report = datasets.validate_dataset(root, workers=workers)
+
+        dataset.path = root
+        dataset.status = DatasetStatus.READY
+        dataset.report = {'files': files_report, 'validation': validation_report}
+        dataset.completed_at = datetime.utcnow()
+        db.add(dataset)
+        # Les fichiers sont extraits: les morceaux de ce dataset ne servent plus
+        db.query(DatasetChunk).filter(DatasetChunk.dataset_id == dataset_id).delete(synchronize_session=False)
+        db.commit()
+        logger.info(f"Dataset {dataset_id} prêt dans {root}")
+
+        # Un autre téléversement peut réutiliser ces morceaux avant d'enregistrer ses lignes: le
+        # ramasse-miettes épargne les morceaux récents, récupérés lors d'une ingestion ou suppression ultérieure
+        try:
+            _collect_unused_chunks(db)
+        except OSError as e:
+            logger.warning(f"Nettoyage du magasin de morceaux impossible : {e}")
+
+        return {
+            'status': 'ready',
+            'progress': 100,
+            'message': "Dataset prêt pour l'entraînement",
+            'results': dataset.report
+        }
+
+    except Exception as e:
+        import traceback
+        logger.error(f"L'ingestion du dataset {dataset_id} a échoué : {str(e)}")
+        logger.error(traceback.format_exc())
+        db.rollback()
+        if dataset:
+            dataset.status = DatasetStatus.FAILED
+            dataset.error_message = str(e)
+            dataset.completed_at = datetime.utcnow()
+            db.add(dataset)
+            db.commit()
+        return {
+            'status': 'failed',
+            'error': str(e),
+            'message': f"L'ingestion du dataset a échoué : {str(e)}"
+        }
+    finally:
+        db.close()
+
+def _collect_unused_chunks(db) -> int:
+    referenced = {sha256 for (sha256,) in db.query(DatasetChunk.sha256).distinct()}
+    removed = datasets.garbage_collect_chunks(referenced)
+    logger.info(f"{removed} morceaux non référencés supprimés du magasin.")
+    return removed
+
+@celery_app.task
+def delete_dataset(dataset_id: str):
+    """Supprime un dataset, ses fichiers extraits et les morceaux qui ne sont plus référencés."""
+    db = SessionLocal()
+    try:
+        datasets.remove_dataset_dir(dataset_id)
+        db.query(DatasetChunk).filter(DatasetChunk.dataset_id == dataset_id).delete(synchronize_session=False)
+        db.query(DatasetFile).filter(DatasetFile.dataset_id == dataset_id).delete(synchronize_session=False)
+        dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+        if dataset:
+            db.delete(dataset)
+        db.commit()
+        logger.info(f"Dataset {dataset_id} supprimé.")
+
+        _collect_unused_chunks(db)
+        return {"status": "success", "message": f"Dataset {dataset_id} et fichiers associés supprimés."}
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Erreur lors de la suppression du dataset {dataset_id}: {e}")
+        return {"status": "error", "message": str(e)}
+    finally:
+        db.close()
+
+@celery_app.task(bind=True)
+def calibrate_worker_resources(self, config: Dict[str, Any]):
+    """Mesurer le débit d'entraînement de plusieurs répartitions des cœurs et retenir la meilleure"""
+    output_dir = "/app/models/calibration"
+    try:
+        dataset_path = config.get("dataset_path")
+        if not dataset_path or not os.path.exists(dataset_path):
+            raise FileNotFoundError(f"Chemin du jeu de données non trouvé : {dataset_path}")
+        os.makedirs(output_dir, exist_ok=True)
+        config = {**config, 'data': datasets.write_training_config(dataset_path, output_dir)}
+
+        def report_progress(done, total):
+            self.update_state(
+                state='PROGRESS',
+                meta={'status': 'calibrating', 'progress': int(100 * done / total), 'message': f"Calibration : répartition {done}/{total}"}
+            )
+
+        report_progress(0, 1)
+        summary = resources.calibrate(config, progress_callback=report_progress)
+        logger.info(f"Calibration terminée : concurrence recommandée {summary['recommended_concurrency']}")
+        return {
+            'status': 'completed',
+            'progress': 100,
+            'message': "Calibration des ressources terminée",
+            'results': summary
+        }
+
+    except Exception as e:
+        import traceback
+        logger.error(f"La calibration des ressources a échoué : {str(e)}")
+        logger.error(traceback.format_exc())
+        return {
+            'status': 'failed',
+            'error': str(e),
+            'message': f"La calibration a échoué : {str(e)}"
+        }
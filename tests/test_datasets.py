@@ -0,0 +1,136 @@
+import hashlib
+import os
+import time
+import zipfile
+
+import pytest
+
+from backend import datasets
+
+
+def test_chunk_count():
+    assert datasets.chunk_count(0, 8) == 1
+    assert datasets.chunk_count(1, 8) == 1
+    assert datasets.chunk_count(8, 8) == 1
+    assert datasets.chunk_count(9, 8) == 2
+    assert datasets.chunk_count(24, 8) == 3
+
+
+def test_expected_chunk_size():
+    assert [datasets.expected_chunk_size(20, 8, i) for i in range(3)] == [8, 8, 4]
+    assert datasets.expected_chunk_size(16, 8, 1) == 8
+    assert datasets.expected_chunk_size(0, 8, 0) == 0
+
+
+def test_normalize_relative_path():
+    assert datasets.normalize_relative_path("train/images/a.jpg") == "train/images/a.jpg"
+    assert datasets.normalize_relative_path("/train//images/./a.jpg") == "train/images/a.jpg"
+    assert datasets.normalize_relative_path("train\\labels\\a.txt") == "train/labels/a.txt"
+    assert datasets.normalize_relative_path("train/../data.yaml") == "data.yaml"
+
+
+@pytest.mark.parametrize("path", ["", ".", "..", "../etc/passwd", "train/../../x"])
+def test_normalize_relative_path_rejects_escape(path):
+    with pytest.raises(ValueError):
+        datasets.normalize_relative_path(path)
+
+
+def test_chunk_store_path_requires_hex_digest(monkeypatch, tmp_path):
+    monkeypatch.setattr(datasets, "CHUNK_STORE_DIR", str(tmp_path))
+    sha256 = hashlib.sha256(b"data").hexdigest()
+    assert datasets.chunk_store_path(sha256) == os.path.join(str(tmp_path), sha256[:2], sha256)
+    for value in ("../" * 21 + "x", sha256.upper(), sha256[:-1], sha256 + "0"):
+        with pytest.raises(AssertionError):
+            datasets.chunk_store_path(value)
+
+
+async def _stream(*parts):
+    for part in parts:
+        yield part
+
+
+@pytest.mark.asyncio
+async def test_receive_chunk_stores_and_deduplicates(monkeypatch, tmp_path):
+    monkeypatch.setattr(datasets, "CHUNK_STORE_DIR", str(tmp_path))
+    sha256 = hashlib.sha256(b"abcdef").hexdigest()
+
+    assert await datasets.receive_chunk(_stream(b"abc", b"def"), 6, sha256) == (sha256, False)
+    assert await datasets.receive_chunk(_stream(b"abcdef"), 6) == (sha256, True)
+    with open(datasets.chunk_store_path(sha256), "rb") as f:
+        assert f.read() == b"abcdef"
+
+
+@pytest.mark.parametrize("parts, size, sha256", [
+    ((b"abc",), 6, None),
+    ((b"abcdefg",), 6, None),
+    ((b"abcdef",), 6, "0" * 64),
+])
+@pytest.mark.asyncio
+async def test_receive_chunk_rejects_invalid_chunk(monkeypatch, tmp_path, parts, size, sha256):
+    monkeypatch.setattr(datasets, "CHUNK_STORE_DIR", str(tmp_path))
+    with pytest.raises(ValueError):
+        await datasets.receive_chunk(_stream(*parts), size, sha256)
+    # Ni morceau stocké ni fichier temporaire abandonné
+    assert os.listdir(tmp_path) == ["tmp"]
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+def test_extract_archive_zip_in_parallel(tmp_path):
+    archive_path = tmp_path / "dataset.zip"
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        for split in ("train", "val"):
+            for i in range(200):
+                archive.writestr(f"dataset/{split}/images/d{i % 7}/{i}.jpg", f"image {i}")
+                archive.writestr(f"dataset/{split}/labels/d{i % 7}/{i}.txt", "0 0.5 0.5 0.1 0.1\n")
+
+    destination = tmp_path / "out"
+    datasets.extract_archive(str(archive_path), str(destination), workers=4)
+
+    root = datasets.find_dataset_root(str(destination))
+    assert root == str(destination / "dataset")
+    assert len(datasets.list_images(os.path.join(root, "train"))) == 200
+    with open(os.path.join(root, "val", "images", "d3", "10.jpg")) as f:
+        assert f.read() == "image 10"
+
+
+def test_extract_archive_rejects_zip_slip(tmp_path):
+    archive_path = tmp_path / "evil.zip"
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        archive.writestr("train/images/a.jpg", "image")
+        archive.writestr("../outside/evil.txt", "evil")
+
+    with pytest.raises(ValueError):
+        datasets.extract_archive(str(archive_path), str(tmp_path / "out"), workers=2)
+    assert not (tmp_path / "outside").exists()
+
+
+def test_extract_archive_rejects_unknown_format(tmp_path):
+    path = tmp_path / "dataset.rar"
+    path.write_bytes(b"not an archive")
+    with pytest.raises(ValueError):
+        datasets.extract_archive(str(path), str(tmp_path / "out"))
+
+
+def test_garbage_collect_chunks(monkeypatch, tmp_path):
+    monkeypatch.setattr(datasets, "CHUNK_STORE_DIR", str(tmp_path))
+    old = time.time() - 2 * datasets.CHUNK_GC_GRACE_SECONDS
+    referenced, unreferenced, recent, reused = (hashlib.sha256(data).hexdigest() for data in (b"a", b"b", b"c", b"d"))
+    for sha256 in (referenced, unreferenced, recent, reused):
+        path = datasets.chunk_store_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(sha256.encode())
+        if sha256 != recent:
+            os.utime(path, (old, old))
+    # Morceau ancien dédupliqué par un téléversement qui n'a pas encore enregistré sa ligne
+    datasets.touch_chunk(reused)
+    os.makedirs(tmp_path / "tmp")
+    (tmp_path / "tmp" / "abandoned").write_bytes(b"partial")
+    os.utime(tmp_path / "tmp" / "abandoned", (old, old))
+
+    assert datasets.garbage_collect_chunks([referenced]) == 2
+    assert os.path.exists(datasets.chunk_store_path(referenced))
+    assert os.path.exists(datasets.chunk_store_path(recent))
+    assert os.path.exists(datasets.chunk_store_path(reused))
+    assert not os.path.exists(datasets.chunk_store_path(unreferenced))
+    assert os.listdir(tmp_path / "tmp") == []
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from backend import evaluation
+
+GT_BOX = (0.1, 0.1, 0.5, 0.5)
+BOX_IOU_60 = (0.1, 0.1, 0.5, 0.34)
+BOX_IOU_95 = (0.1, 0.1, 0.5, 0.48)
+
+
+def _data(predictions, ground_truth, images=1, unreadable=(), names=("a", "b")):
+    """Cache de prédictions minimal : `predictions` = [(image, classe, confiance, boîte)], `ground_truth` = [(image, classe, boîte)]."""
+    return {
+        "images": np.array([f"{i}.jpg" for i in range(images)]),
+        "class_ids": np.arange(len(names), dtype=np.int32),
+        "class_names": np.array(names),
+        "pred_image": np.array([p[0] for p in predictions], dtype=np.int32),
+        "pred_class": np.array([p[1] for p in predictions], dtype=np.int32),
+        "pred_conf": np.array([p[2] for p in predictions], dtype=np.float32),
+        "pred_boxes": np.array([p[3] for p in predictions], dtype=np.float32).reshape(-1, 4),
+        "gt_image": np.array([g[0] for g in ground_truth], dtype=np.int32),
+        "gt_class": np.array([g[1] for g in ground_truth], dtype=np.int32),
+        "gt_boxes": np.array([g[2] for g in ground_truth], dtype=np.float32).reshape(-1, 4),
+        "unreadable": np.array(unreadable, dtype=np.int32),
+    }
+
+
+def test_box_iou_pairs():
+    boxes = np.array([GT_BOX, GT_BOX, GT_BOX], dtype=np.float32)
+    others = np.array([BOX_IOU_60, BOX_IOU_95, (0.6, 0.6, 0.9, 0.9)], dtype=np.float32)
+    assert evaluation.box_iou_pairs(boxes, others) == pytest.approx([0.6, 0.95, 0.0], abs=1e-5)
+
+
+def test_match_predictions_only_within_image_and_class():
+    data = _data(
+        [(0, 0, 0.9, GT_BOX), (1, 0, 0.9, GT_BOX), (0, 1, 0.9, GT_BOX)],
+        [(0, 0, GT_BOX)],
+        images=2,
+    )
+    tp = evaluation.match_predictions(data, np.array([0.5]))
+    assert tp[:, 0].tolist() == [True, False, False]
+
+
+def test_match_predictions_in_descending_confidence_order():
+    # La prédiction la plus confiante prend l'annotation, même si une autre la recouvre mieux
+    data = _data([(0, 0, 0.3, BOX_IOU_95), (0, 0, 0.9, BOX_IOU_60)], [(0, 0, GT_BOX)])
+    tp = evaluation.match_predictions(data, np.array([0.5, 0.75]))
+    assert tp.tolist() == [[False, True], [True, False]]
+
+
+def test_match_predictions_falls_back_to_best_unmatched_ground_truth():
+    other_box = (0.1, 0.1, 0.5, 0.4)
+    data = _data(
+        [(0, 0, 0.9, GT_BOX), (0, 0, 0.8, GT_BOX)],
+        [(0, 0, GT_BOX), (0, 0, other_box)],
+    )
+    tp = evaluation.match_predictions(data, np.array([0.5]))
+    assert tp[:, 0].tolist() == [True, True]
+
+
+def test_match_predictions_without_ground_truth():
+    data = _data([(0, 0, 0.9, GT_BOX)], [])
+    assert not evaluation.match_predictions(data, np.array([0.5])).any()
+
+
+def test_compute_metrics_perfect_predictions():
+    data = _data(
+        [(0, 0, 0.9, GT_BOX), (1, 1, 0.8, GT_BOX)],
+        [(0, 0, GT_BOX), (1, 1, GT_BOX)],
+        images=2,
+    )
+    metrics = evaluation.compute_metrics(data, per_class=True)
+    assert metrics["precision"] == metrics["recall"] == metrics["f1"] == 1.0
+    # Comme `model.val()` d'Ultralytics, l'interpolation sur 101 points donne 0.995 pour un modèle parfait
+    assert metrics["mAP50"] == pytest.approx(0.995)
+    assert metrics["mAP50-95"] == pytest.approx(0.995)
+    assert metrics["images"] == 2
+    assert [row["name"] for row in metrics["per_class"]] == ["a", "b"]
+
+
+def test_compute_metrics_conf_threshold_keeps_confident_matches():
+    data = _data([(0, 0, 0.3, BOX_IOU_95), (0, 0, 0.9, BOX_IOU_60)], [(0, 0, GT_BOX)])
+    metrics = evaluation.compute_metrics(data, conf_threshold=0.5, iou_threshold=0.5)
+    assert metrics["predictions"] == 1
+    assert metrics["precision"] == metrics["recall"] == 1.0
+
+
+def test_compute_metrics_class_without_predictions_has_zero_ap():
+    data = _data([(0, 0, 0.9, GT_BOX)], [(0, 0, GT_BOX), (0, 1, GT_BOX)])
+    rows = evaluation.compute_metrics(data, per_class=True)["per_class"]
+    assert rows[1]["AP50"] == rows[1]["AP50-95"] == 0.0
+    assert rows[1]["recall"] == 0.0
+    assert evaluation.compute_metrics(data)["mAP50"] == pytest.approx(rows[0]["AP50"] / 2)
+
+
+def test_compute_metrics_excludes_unreadable_images():
+    data = _data([(0, 0, 0.9, GT_BOX)], [(0, 0, GT_BOX)], images=3, unreadable=[2])
+    metrics = evaluation.compute_metrics(data)
+    assert metrics["images"] == 2
+    assert metrics["unreadable_images"] == 1
+
+
+def test_load_ground_truth_skips_unreadable_images(tmp_path):
+    images_dir, labels_dir = tmp_path / "images", tmp_path / "labels"
+    images_dir.mkdir()
+    labels_dir.mkdir()
+    (labels_dir / "0.txt").write_text("0 0.3 0.3 0.4 0.4\n1 0.1 0.1 0.5 0.1 0.5 0.5\n")
+    (labels_dir / "1.txt").write_text("0 0.5 0.5 0.2 0.2\n")
+    image_paths = [str(images_dir / "0.jpg"), str(images_dir / "1.jpg")]
+
+    ground_truth = evaluation.load_ground_truth(image_paths, skip=[1])
+    assert ground_truth["gt_image"].tolist() == [0, 0]
+    assert ground_truth["gt_class"].tolist() == [0, 1]
+    np.testing.assert_allclose(ground_truth["gt_boxes"], [GT_BOX, GT_BOX], atol=1e-6)
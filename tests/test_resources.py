@@ -0,0 +1,119 @@
+import json
+import socket
+
+import pytest
+
+from backend import resources
+
+
+@pytest.fixture(autouse=True)
+def eight_core_host(monkeypatch, tmp_path):
+    monkeypatch.setenv(resources.HOST_CORES_ENV, ",".join(str(c) for c in range(8)))
+    monkeypatch.setenv("WORKER_CONCURRENCY", "2")
+    monkeypatch.setattr(resources, "CALIBRATION_PATH", str(tmp_path / "calibration.json"))
+
+
+def test_available_cores_from_environment():
+    assert resources.available_cores() == list(range(8))
+
+
+def test_plan_resources_splits_cores_between_slots():
+    first, second = resources.plan_resources(slot=0), resources.plan_resources(slot=1)
+    assert first["concurrency"] == second["concurrency"] == 2
+    assert first["cores"] == [0, 1, 2, 3]
+    assert second["cores"] == [4, 5, 6, 7]
+    assert first["dataloader_workers"] == 1
+    assert first["intra_op_threads"] == 3
+    assert first["inter_op_threads"] == 1
+    assert first["source"] == "heuristic"
+
+
+def test_plan_resources_wraps_slot_index():
+    assert resources.plan_resources(4, slot=5)["cores"] == [2, 3]
+
+
+def test_plan_resources_with_more_slots_than_cores():
+    plan = resources.plan_resources(16, slot=9)
+    assert plan["cores"] == [1]
+    assert plan["dataloader_workers"] == 0
+    assert plan["intra_op_threads"] == 1
+
+
+def test_plan_resources_keeps_a_core_for_compute():
+    plan = resources.plan_resources(2, slot=0, dataloader_workers=10)
+    assert plan["dataloader_workers"] == 3
+    assert plan["intra_op_threads"] == 1
+    assert plan["source"] == "explicit"
+
+
+def test_plan_resources_uses_calibration_of_this_host():
+    layouts = {
+        resources.calibration_key(8, 2): {"dataloader_workers": 2},
+        resources.calibration_key(8, 4, "other-host"): {"dataloader_workers": 1},
+    }
+    with open(resources.CALIBRATION_PATH, "w") as f:
+        json.dump({"layouts": layouts}, f)
+
+    plan = resources.plan_resources(2, slot=0)
+    assert plan["dataloader_workers"] == 2
+    assert plan["intra_op_threads"] == 2
+    assert plan["source"] == "calibration"
+    assert resources.plan_resources(4, slot=0)["source"] == "heuristic"
+
+
+def test_plan_resources_ignores_unreadable_calibration():
+    with open(resources.CALIBRATION_PATH, "w") as f:
+        f.write("{")
+    assert resources.plan_resources(2, slot=0)["source"] == "heuristic"
+
+
+def test_calibration_key_includes_host():
+    assert resources.calibration_key(8, 2) == f"{socket.gethostname()}:8:2"
+    assert resources.calibration_key(8, 2, "gpu-01") == "gpu-01:8:2"
+
+
+@pytest.mark.parametrize("cores_per_slot, workers", [(1, 0), (2, 1), (7, 1), (8, 2), (32, 8)])
+def test_default_dataloader_workers(cores_per_slot, workers):
+    assert resources.default_dataloader_workers(cores_per_slot) == workers
+
+
+def test_candidate_layouts():
+    assert resources.candidate_layouts(8) == [
+        {"concurrency": 1, "dataloader_workers": 0},
+        {"concurrency": 1, "dataloader_workers": 1},
+        {"concurrency": 1, "dataloader_workers": 2},
+        {"concurrency": 1, "dataloader_workers": 4},
+        {"concurrency": 2, "dataloader_workers": 0},
+        {"concurrency": 2, "dataloader_workers": 1},
+        {"concurrency": 2, "dataloader_workers": 2},
+        {"concurrency": 4, "dataloader_workers": 0},
+        {"concurrency": 4, "dataloader_workers": 1},
+        {"concurrency": 8, "dataloader_workers": 0},
+    ]
+
+
+def test_candidate_layouts_with_explicit_concurrency():
+    layouts = resources.candidate_layouts(4, [3, 0, 8, 3])
+    assert layouts == [{"concurrency": 3, "dataloader_workers": 0}]
+
+
+def test_keep_dataloader_workers_on_cpu(tmp_path):
+    pytest.importorskip("torch")
+    YOLO = pytest.importorskip("ultralytics").YOLO
+    from PIL import Image
+
+    for split in ("train", "val"):
+        (tmp_path / split / "images").mkdir(parents=True)
+        (tmp_path / split / "labels").mkdir(parents=True)
+        for i in range(4):
+            Image.new("RGB", (64, 64), (40 * i, 80, 120)).save(tmp_path / split / "images" / f"{i}.png")
+            (tmp_path / split / "labels" / f"{i}.txt").write_text("0 0.5 0.5 0.3 0.3\n")
+    data = tmp_path / "dataset.yaml"
+    data.write_text(f"path: {tmp_path}\ntrain: train/images\nval: val/images\nnames:\n  0: objet\n")
+
+    # Sans le rappel, Ultralytics ramène `workers` à 0 sur CPU
+    model = YOLO("yolov8n.yaml")
+    resources.keep_dataloader_workers(model, 1)
+    model.train(data=str(data), epochs=1, imgsz=32, batch=2, workers=1, device="cpu",
+                project=str(tmp_path / "runs"), val=False, plots=False, verbose=False)
+    assert model.trainer.train_loader.num_workers == 1